@@ -1,10 +1,28 @@
 # flashcards_app.py
-from flask import Flask, render_template, request, send_file, redirect, url_for, flash
-import os, io, json, requests
+from flask import Flask, Response, render_template, request, send_file, redirect, url_for, flash, stream_with_context
+import os, io, re, sys, copy, time, queue, asyncio, zipfile, hashlib, secrets
+from dataclasses import dataclass
+from textwrap import TextWrapper
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+from threading import Condition, RLock, Thread
+from itertools import repeat
+from concurrent.futures import Future, ProcessPoolExecutor
+import diskcache
+import fastjsonschema
+import httpx
+import ijson
+from lxml import etree
+import orjson
+from cachetools import LRUCache
 from reportlab.lib.pagesizes import landscape, A4
 from reportlab.pdfgen import canvas as pdf_canvas
+from pypdf import PdfWriter
 from pptx import Presentation
 from pptx.util import Inches, Pt
+from pptx.enum.text import PP_ALIGN
+from pptx.dml.color import RGBColor
+from pptx.oxml.ns import qn
 from dotenv import load_dotenv
 
 # ------------------------------------------------------------
@@ -24,22 +42,30 @@ load_dotenv(os.path.join(BASE_DIR, ".env"))
 # ------------------------------------------------------------
 GEMINI_KEY = os.getenv("GEMINI_API_KEY")
 GEMINI_URL = "https://generativelanguage.googleapis.com/v1beta/models/gemini-2.5-pro:generateContent"
+GEMINI_STREAM_URL = "https://generativelanguage.googleapis.com/v1beta/models/gemini-2.5-pro:streamGenerateContent"
+
+GEMINI_RETRIES = 3
+GEMINI_RETRY_STATUSES = (429, 500, 502, 503, 504)
+GEMINI_BACKOFF = 0.3  # seconds, doubled per retry
+GEMINI_RETRY_AFTER_STATUSES = (429, 503)  # honor Retry-After on these
+GEMINI_MAX_RETRY_AFTER = 30  # seconds; longer Retry-After values are clamped
+# Failures where the request never reached Gemini. Read timeouts are not
+# retried: the prompt may already be generating (and billed).
+GEMINI_RETRY_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+GEMINI_TIMEOUT = 90  # seconds, per connect/read
 
 print(f"[DEBUG] GEMINI_API_KEY loaded: {bool(GEMINI_KEY)}")
 
 # ------------------------------------------------------------
 # Gemini helper (proper REST request for Gemini 2.x)
 # ------------------------------------------------------------
-def gemini_generate(prompt_text: str) -> str:
-    """
-    Sends a request to the Gemini 2.5 Pro API endpoint.
-    Uses ?key=API_KEY for authentication.
-    """
-    if not GEMINI_KEY or not GEMINI_URL:
-        raise RuntimeError("Gemini API key or URL missing")
+# Matches a whole ```json ... ``` (or bare ```) fenced block and captures the body
+_FENCE_RE = re.compile(r"^\s*```(?:json)?\s*(.*?)\s*```\s*$", re.IGNORECASE | re.DOTALL)
+# JSON whitespace plus backticks: what may trail the root object in streamed output
+_TRAILING_CHARS = " \t\r\n`"
 
-    headers = {"Content-Type": "application/json"}
 
+def _gemini_body(prompt_text: str) -> bytes:
     body = {
         "contents": [
             {
@@ -48,15 +74,122 @@ def gemini_generate(prompt_text: str) -> str:
             }
         ]
     }
+    return orjson.dumps(body)
 
-    try:
-        resp = requests.post(
-            GEMINI_URL,
-            headers=headers,
-            params={"key": GEMINI_KEY},  # <-- key attached as query param
-            json=body,
-            timeout=90,
+
+def _gemini_output_text(content: bytes) -> str:
+    """Pulls the model's text out of a generateContent response body."""
+    data = orjson.loads(content)
+    candidates = data.get("candidates", [])
+    if not candidates:
+        raise ValueError("No candidates returned from Gemini")
+
+    output_text = candidates[0].get("content", {}).get("parts", [{}])[0].get("text", "")
+
+    # Clean up Markdown-style code blocks if present
+    m = _FENCE_RE.match(output_text)
+    if m:
+        output_text = m.group(1)
+
+    if app.debug:
+        print("[DEBUG] Gemini raw output:", output_text[:500])
+    return output_text
+
+
+# ------------------------------------------------------------
+# Async Gemini client
+# One long-lived event loop, on its own thread, owns an HTTP/2
+# httpx.AsyncClient, so concurrent generations are coroutines multiplexed
+# over one TLS connection instead of each holding a thread and a socket.
+# ------------------------------------------------------------
+_GEMINI_LOOP = None
+_GEMINI_LOOP_LOCK = RLock()
+_ACLIENT = None
+
+
+def gemini_loop():
+    """Returns the Gemini event loop, starting its thread on first use."""
+    global _GEMINI_LOOP
+    with _GEMINI_LOOP_LOCK:
+        if _GEMINI_LOOP is None:
+            _GEMINI_LOOP = asyncio.new_event_loop()
+            Thread(target=_GEMINI_LOOP.run_forever, name="gemini-loop", daemon=True).start()
+    return _GEMINI_LOOP
+
+
+def _aclient() -> httpx.AsyncClient:
+    # Only called from coroutines on gemini_loop(), so the client's
+    # connection pool never crosses event loops
+    global _ACLIENT
+    if _ACLIENT is None:
+        _ACLIENT = httpx.AsyncClient(
+            http2=True,
+            timeout=GEMINI_TIMEOUT,
+            limits=httpx.Limits(max_connections=64),
+            headers={"Content-Type": "application/json"},
         )
+    return _ACLIENT
+
+
+def _retry_delay(attempt: int, resp=None) -> float:
+    """Seconds to wait before the next attempt: Retry-After if sent, else backoff."""
+    retry_after = resp.headers.get("Retry-After") if resp is not None else None
+    if retry_after and resp.status_code in GEMINI_RETRY_AFTER_STATUSES:
+        try:
+            delay = float(retry_after)
+        except ValueError:
+            try:
+                when = parsedate_to_datetime(retry_after)
+                delay = (when - datetime.now(timezone.utc)).total_seconds()
+            except (TypeError, ValueError):
+                delay = None
+        if delay is not None:
+            return min(max(0.0, delay), GEMINI_MAX_RETRY_AFTER)
+    return GEMINI_BACKOFF * 2 ** attempt
+
+
+async def _gemini_send(url: str, params: dict, prompt_text: str) -> httpx.Response:
+    """
+    POSTs prompt_text to a Gemini endpoint, retrying connection failures
+    and retryable statuses within one budget of GEMINI_RETRIES. Returns the
+    response with its body unread; the caller must aclose() it.
+    """
+    client = _aclient()
+    request = client.build_request(
+        "POST",
+        url,
+        params={"key": GEMINI_KEY, **params},  # <-- key attached as query param
+        content=_gemini_body(prompt_text),
+    )
+    for attempt in range(GEMINI_RETRIES + 1):
+        try:
+            resp = await client.send(request, stream=True)
+        except GEMINI_RETRY_ERRORS as e:
+            if attempt == GEMINI_RETRIES:
+                raise
+            print(f"[DEBUG] Gemini connection error, retrying: {e!r}")
+            await asyncio.sleep(_retry_delay(attempt))
+            continue
+        if resp.status_code not in GEMINI_RETRY_STATUSES or attempt == GEMINI_RETRIES:
+            return resp
+        await resp.aclose()
+        await asyncio.sleep(_retry_delay(attempt, resp))
+
+
+async def gemini_generate_async(prompt_text: str) -> str:
+    """
+    Sends a request to the Gemini 2.5 Pro API endpoint.
+    Uses ?key=API_KEY for authentication. Runs on gemini_loop().
+    """
+    if not GEMINI_KEY or not GEMINI_URL:
+        raise RuntimeError("Gemini API key or URL missing")
+
+    try:
+        resp = await _gemini_send(GEMINI_URL, {}, prompt_text)
+        try:
+            await resp.aread()
+        finally:
+            await resp.aclose()
 
         # Debugging info
         print(f"[DEBUG] Gemini API status: {resp.status_code}")
@@ -64,21 +197,7 @@ def gemini_generate(prompt_text: str) -> str:
             print(f"[DEBUG] Response text: {resp.text}")
         resp.raise_for_status()
 
-        data = resp.json()
-        candidates = data.get("candidates", [])
-        if not candidates:
-            raise ValueError("No candidates returned from Gemini")
-
-        output_text = candidates[0].get("content", {}).get("parts", [{}])[0].get("text", "")
-
-        # Clean up Markdown-style code blocks if present
-        if output_text.startswith("```"):
-            output_text = output_text.strip("`").strip()
-            if output_text.lower().startswith("json"):
-                output_text = output_text[4:].strip()
-
-        print("[DEBUG] Gemini raw output:", output_text[:500])
-        return output_text
+        return _gemini_output_text(resp.content)
 
     except Exception as e:
         print(f"[Gemini API error] {e}")
@@ -87,9 +206,103 @@ def gemini_generate(prompt_text: str) -> str:
         raise
 
 
+async def _gemini_stream_async(prompt_text: str):
+    resp = await _gemini_send(GEMINI_STREAM_URL, {"alt": "sse"}, prompt_text)
+    try:
+        print(f"[DEBUG] Gemini stream status: {resp.status_code}")
+        if resp.status_code != 200:
+            await resp.aread()
+            print(f"[DEBUG] Response text: {resp.text}")
+        resp.raise_for_status()
+
+        async for line in resp.aiter_lines():
+            if not line.startswith("data: "):
+                continue
+            candidates = orjson.loads(line[6:]).get("candidates", [])
+            if not candidates:
+                continue
+            for part in candidates[0].get("content", {}).get("parts", []):
+                if part.get("text"):
+                    yield part["text"]
+    finally:
+        await resp.aclose()
+
+
+def gemini_stream(prompt_text: str):
+    """
+    Streams a generation from Gemini (streamGenerateContent, SSE).
+    Yields output text fragments as the model emits them.
+
+    The request runs on gemini_loop() through the same client and retry
+    policy as gemini_generate_async(); fragments are handed back to the
+    calling thread through a queue.
+    """
+    if not GEMINI_KEY or not GEMINI_STREAM_URL:
+        raise RuntimeError("Gemini API key or URL missing")
+
+    fragments = queue.Queue()
+    done = object()
+
+    async def pump():
+        try:
+            async for text in _gemini_stream_async(prompt_text):
+                fragments.put(text)
+        except Exception as e:
+            fragments.put(e)
+        else:
+            fragments.put(done)
+
+    fut = asyncio.run_coroutine_threadsafe(pump(), gemini_loop())
+    try:
+        while True:
+            item = fragments.get()
+            if item is done:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        # Client went away mid-stream: stop reading from Gemini
+        fut.cancel()
+
+
+def stream_flashcards(prompt_text: str):
+    """
+    Yields each flashcard dict as soon as it is complete in Gemini's
+    streamed output, parsing the JSON incrementally with ijson.
+    """
+    cards = ijson.sendable_list()
+    parser = ijson.items_coro(cards, "flashcards.item", use_float=True)
+    started = False
+    pending = ""
+
+    for text in gemini_stream(prompt_text):
+        if not started:
+            # Drop an opening ```json fence (or any other preamble)
+            start = text.find("{")
+            if start < 0:
+                continue
+            text = text[start:]
+            started = True
+        pending += text
+        # Hold back any trailing whitespace/backticks: if nothing follows them
+        # they are the closing fence, which ijson would reject as garbage
+        cut = len(pending.rstrip(_TRAILING_CHARS))
+        if cut:
+            parser.send(pending[:cut].encode())
+            pending = pending[cut:]
+            yield from cards
+            del cards[:]
+
+    parser.close()
+    yield from cards
+
+
 # ------------------------------------------------------------
 # Prompt template
 # ------------------------------------------------------------
+MAX_INPUT_CHARS = 8000  # content beyond this is not sent to Gemini
+
 FLASHCARD_PROMPT = """
 You are an intelligent assistant that must create flashcards from the provided content.
 Output only valid JSON (no markdown, no code fences, no explanations).
@@ -113,74 +326,483 @@ CONTENT:
 {input_text}
 """
 
+# Shape of the model's JSON; compiled once into plain Python validators
+CARD_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "question": {"type": "string"},
+        "answer": {"type": "string"},
+    },
+    "required": ["question", "answer"],
+}
+FLASHCARDS_SCHEMA = {
+    "type": "object",
+    "properties": {"flashcards": {"type": "array", "items": CARD_SCHEMA}},
+    "required": ["flashcards"],
+}
+validate_card = fastjsonschema.compile(CARD_SCHEMA)
+validate_flashcards = fastjsonschema.compile(FLASHCARDS_SCHEMA)
+
+BATCH_FLASHCARD_PROMPT = """
+You are an intelligent assistant that must create flashcards from {doc_count} independent documents.
+Output only valid JSON (no markdown, no code fences, no explanations).
+
+Each flashcard object must have:
+  - "question": a short question or heading (string)
+  - "answer": 2–4 bullet points or a short summary (string, using \\n for new lines)
+
+Return one list of flashcards per document, in document order, so that
+"flashcards_by_doc"[0] holds the cards for DOC 1, [1] for DOC 2, and so on.
+Never mix content between documents.
+
+Example output for 2 documents:
+{{
+  "flashcards_by_doc": [
+    [{{"question": "What is AI?", "answer": "• Simulation of human intelligence\\n• Enables learning and reasoning"}}],
+    [{{"question": "What is HTTP?", "answer": "• Request/response protocol\\n• Stateless"}}]
+  ]
+}}
+
+Return only JSON — do not include any text or markdown outside it.
+
+{documents}
+"""
+
+
+# ------------------------------------------------------------
+# Request batching: /new calls arriving within BATCH_WINDOW_MS of each other
+# share one Gemini round-trip (up to BATCH_MAX documents per prompt).
+# ------------------------------------------------------------
+BATCH_WINDOW = int(os.getenv("BATCH_WINDOW_MS", 50)) / 1000
+BATCH_MAX = 8
+# How long a /new request waits for its batch: one full Gemini read plus
+# room for retries and backoff
+GENERATE_TIMEOUT = int(os.getenv("GENERATE_TIMEOUT", 2 * GEMINI_TIMEOUT))
+
+_PENDING = []  # [(input_text, Future)]
+_BATCH_COND = Condition()
+_batch_thread = None
+
+
+async def _generate_single(input_text: str) -> dict:
+    return orjson.loads(await gemini_generate_async(FLASHCARD_PROMPT.format(input_text=input_text)))
+
+
+async def _run_batch(batch):
+    texts = [text for text, _ in batch]
+    try:
+        if len(texts) == 1:
+            results = [await _generate_single(texts[0])]
+        else:
+            documents = "\n\n".join(f"=== DOC {i} ===\n{t}" for i, t in enumerate(texts, start=1))
+            prompt = BATCH_FLASHCARD_PROMPT.format(doc_count=len(texts), documents=documents)
+            by_doc = orjson.loads(await gemini_generate_async(prompt)).get("flashcards_by_doc", [])
+            if len(by_doc) != len(texts):
+                raise ValueError(f"Batched output has {len(by_doc)} documents, expected {len(texts)}")
+            results = [{"flashcards": cards} for cards in by_doc]
+    except (ValueError, orjson.JSONDecodeError) as e:
+        if len(batch) == 1:
+            batch[0][1].set_exception(e)
+            return
+        # The combined answer was unusable; fall back to one call per document
+        print(f"[Gemini batch error] {e}; retrying {len(batch)} documents individually")
+        await asyncio.gather(*(_run_batch([item]) for item in batch))
+        return
+    except Exception as e:
+        # HTTP/transport failures would only repeat per document
+        for _, fut in batch:
+            fut.set_exception(e)
+        return
+
+    for (_, fut), result in zip(batch, results):
+        fut.set_result(result)
+
+
+def _batch_worker():
+    while True:
+        with _BATCH_COND:
+            while not _PENDING:
+                _BATCH_COND.wait()
+            deadline = time.monotonic() + BATCH_WINDOW
+            while len(_PENDING) < BATCH_MAX:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                _BATCH_COND.wait(remaining)
+            batch = _PENDING[:BATCH_MAX]
+            del _PENDING[:BATCH_MAX]
+        asyncio.run_coroutine_threadsafe(_run_batch(batch), gemini_loop())
+
+
+def generate_flashcards(input_text: str) -> dict:
+    """
+    Queues input_text for the next Gemini batch and waits for its result.
+    Returns the parsed {"flashcards": [...]} object for this document.
+    Raises TimeoutError if no result arrives within GENERATE_TIMEOUT.
+    """
+    global _batch_thread
+    fut = Future()
+    with _BATCH_COND:
+        if _batch_thread is None:
+            # Started lazily so gunicorn forks workers before any thread exists
+            _batch_thread = Thread(target=_batch_worker, name="gemini-batcher", daemon=True)
+            _batch_thread.start()
+        _PENDING.append((input_text, fut))
+        _BATCH_COND.notify()
+    return fut.result(timeout=GENERATE_TIMEOUT)
+
+
+# ------------------------------------------------------------
+# Prompt cache: exact blake2b(text) -> cards, in memory + on disk.
+# Optional semantic tier (SEMANTIC_CACHE=1) also matches near-identical
+# inputs by MiniLM embedding cosine similarity via a FAISS index. Only
+# inputs that fit the model's window take part: MiniLM truncates longer
+# ones, so texts sharing a prefix would embed alike.
+# ------------------------------------------------------------
+PROMPT_CACHE_DIR = os.path.join(BASE_DIR, ".cache")
+SEMANTIC_CACHE = os.getenv("SEMANTIC_CACHE") == "1"
+SEMANTIC_THRESHOLD = 0.95
+
+_MEM_CACHE = LRUCache(maxsize=512)
+_DISK_CACHE = diskcache.Cache(PROMPT_CACHE_DIR)  # safe across threads/processes on its own
+_CACHE_LOCK = RLock()  # guards _MEM_CACHE, _sem_index and _sem_keys only
+_EMBED_LOCK = RLock()  # first-use model load
+
+_embedder = None
+_sem_index = None
+_sem_keys = []
+
+
+def _prompt_key(text: str) -> str:
+    return hashlib.blake2b(text.encode("utf-8")).hexdigest()
+
+
+def _get_embedder():
+    """Loads the model and rebuilds the FAISS index from disk on first use."""
+    global _embedder, _sem_index
+    if _embedder is None:
+        with _EMBED_LOCK:
+            if _embedder is None:
+                import faiss
+                from sentence_transformers import SentenceTransformer
+
+                model = SentenceTransformer("sentence-transformers/all-MiniLM-L6-v2")
+                index = faiss.IndexFlatIP(model.get_sentence_embedding_dimension())
+                keys = []
+                for key in _DISK_CACHE:
+                    emb = _DISK_CACHE[key].get("embedding")
+                    if emb is not None:
+                        index.add(emb)
+                        keys.append(key)
+                with _CACHE_LOCK:
+                    _sem_index = index
+                    _sem_keys[:] = keys
+                _embedder = model
+    return _embedder
+
+
+def _embed(text: str):
+    """
+    Returns a normalized (1, dim) float32 embedding for text, or None when
+    text has more word-pieces than the model reads.
+    """
+    model = _get_embedder()
+    ids = model.tokenizer(text, truncation=True, max_length=model.max_seq_length + 1)["input_ids"]
+    if len(ids) > model.max_seq_length:
+        return None
+    return model.encode([text], normalize_embeddings=True).astype("float32")
+
+
+def cache_lookup(text: str):
+    """
+    Returns (cards, embedding). cards is the cached list for text (exact,
+    then semantic) or None; embedding is text's embedding when the semantic
+    tier computed one, to pass on to cache_store(). A semantic hit is also
+    cached under text's exact key, so repeats skip the encoder.
+    """
+    key = _prompt_key(text)
+    with _CACHE_LOCK:
+        cards = _MEM_CACHE.get(key)
+    if cards is not None:
+        return cards, None
+    entry = _DISK_CACHE.get(key)
+    if entry is not None:
+        with _CACHE_LOCK:
+            _MEM_CACHE[key] = entry["cards"]
+        return entry["cards"], None
+
+    if not SEMANTIC_CACHE:
+        return None, None
+    emb = _embed(text)
+    if emb is None:
+        return None, None
+    match = None
+    with _CACHE_LOCK:
+        if _sem_index.ntotal:
+            scores, idx = _sem_index.search(emb, 1)
+            if scores[0][0] >= SEMANTIC_THRESHOLD:
+                match = _sem_keys[idx[0][0]]
+    if match is not None:
+        entry = _DISK_CACHE.get(match)
+        if entry is not None:
+            # No embedding: the matched entry already represents it in the index
+            cache_store(text, entry["cards"], None, semantic=False)
+            return entry["cards"], None
+    return None, emb
+
+
+def cache_store(text: str, cards, embedding=None, semantic=True):
+    """
+    Caches cards for text; embedding is the one cache_lookup() returned, if
+    any. semantic=False stores the exact key only.
+    """
+    key = _prompt_key(text)
+    if SEMANTIC_CACHE and semantic and embedding is None:
+        embedding = _embed(text)
+    with _CACHE_LOCK:
+        _MEM_CACHE[key] = cards
+        if embedding is not None:
+            _sem_index.add(embedding)
+            _sem_keys.append(key)
+    _DISK_CACHE.set(key, {"cards": cards, "embedding": embedding})
 
 
 # ------------------------------------------------------------
-# Simple in-memory storage
+# Flashcard set storage
+# In-process bounded LRU by default; REDIS_URL is required to share sets
+# across gunicorn workers (WEB_CONCURRENCY > 1).
 # ------------------------------------------------------------
-STORE = {}
+@dataclass(slots=True)
+class Card:
+    question: str
+    answer: str
+
+
+def to_cards(items):
+    """Converts {"question", "answer"} dicts (model output, cache, Redis) to Cards."""
+    return [Card(c["question"], c["answer"]) for c in items]
+
+
+class MemoryStore:
+    def __init__(self, maxsize: int):
+        self._data = LRUCache(maxsize=maxsize)
+        # Listing titles must not count as use, so they live outside the LRU
+        self._titles = {}
+        self._lock = RLock()
+
+    def get(self, sid):
+        with self._lock:
+            return self._data.get(sid)
+
+    def set(self, sid, value):
+        with self._lock:
+            if sid not in self._data and len(self._data) >= self._data.maxsize:
+                evicted, _ = self._data.popitem()  # least recently used
+                del self._titles[evicted]
+            self._data[sid] = value
+            self._titles[sid] = value["title"]
+
+    def titles(self):
+        with self._lock:
+            return list(self._titles.items())
+
+
+class RedisStore:
+    PREFIX = "set:"
+    TTL = 86400  # seconds
+
+    def __init__(self, url: str):
+        import redis
+
+        self._r = redis.Redis.from_url(url)
+
+    def get(self, sid):
+        raw = self._r.get(self.PREFIX + sid)
+        if not raw:
+            return None
+        value = orjson.loads(raw)
+        value["cards"] = to_cards(value["cards"])
+        return value
+
+    def set(self, sid, value):
+        self._r.set(self.PREFIX + sid, orjson.dumps(value), ex=self.TTL)
+
+    def titles(self):
+        keys = list(self._r.scan_iter(match=self.PREFIX + "*"))
+        if not keys:
+            return []
+        return [
+            (key.decode()[len(self.PREFIX):], orjson.loads(raw)["title"])
+            for key, raw in zip(keys, self._r.mget(keys))
+            if raw
+        ]
+
+
+REDIS_URL = os.getenv("REDIS_URL")
+if not REDIS_URL and int(os.getenv("WEB_CONCURRENCY", 1)) > 1:
+    # Each worker would hold its own MemoryStore, so a set saved by one
+    # worker 404s on the others.
+    raise RuntimeError("REDIS_URL must be set when running more than one worker (WEB_CONCURRENCY > 1)")
+STORE = RedisStore(REDIS_URL) if REDIS_URL else MemoryStore(int(os.getenv("STORE_MAX", 1000)))
 
 # ------------------------------------------------------------
 # Routes
 # ------------------------------------------------------------
 @app.route("/")
 def index():
-    sets = [{"id": sid, "title": STORE[sid]["title"]} for sid in STORE]
+    sets = [{"id": sid, "title": title} for sid, title in STORE.titles()]
     return render_template("index.html", sets=sets)
 
 
+_DOCX_NS = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+_DOCX_P, _DOCX_T = _DOCX_NS + "p", _DOCX_NS + "t"
+_DOCX_TAB, _DOCX_BR, _DOCX_CR = _DOCX_NS + "tab", _DOCX_NS + "br", _DOCX_NS + "cr"
+_DOCX_BR_TYPE = _DOCX_NS + "type"
+
+
+def _docx_paragraph_text(para) -> str:
+    """Paragraph text with tabs and line breaks, matching python-docx's Paragraph.text."""
+    parts = []
+    for el in para.iter(_DOCX_T, _DOCX_TAB, _DOCX_BR, _DOCX_CR):
+        if el.tag == _DOCX_T:
+            parts.append(el.text or "")
+        elif el.tag == _DOCX_TAB:
+            parts.append("\t")
+        elif el.tag == _DOCX_CR or el.get(_DOCX_BR_TYPE, "textWrapping") == "textWrapping":
+            parts.append("\n")  # page/column breaks add no text
+    return "".join(parts)
+
+
+def read_form_input():
+    """
+    Returns (title, input_text) from the create form, with any uploaded
+    document's text appended and the result clipped to MAX_INPUT_CHARS.
+    Each source is clipped to its share of the budget before combining, so
+    large uploads are never fully extracted or copied.
+    """
+    title = request.form.get("title") or "Untitled"
+    text_input = (request.form.get("text", "") or "")[:MAX_INPUT_CHARS]
+    remaining = MAX_INPUT_CHARS - len(text_input) - 1  # 1 for the joining newline
+
+    # -------- File upload extraction --------
+    uploaded_file = request.files.get("file")
+    extracted_text = ""
+    if uploaded_file and uploaded_file.filename:
+        fname = uploaded_file.filename.lower()
+        # Collect parts and join once; stop as soon as the budget is used,
+        # so the tail of long documents is never parsed.
+        parts, total = [], 0
+        if not fname.endswith((".pdf", ".docx", ".txt")):
+            flash("Unsupported file type. Upload PDF, DOCX, or TXT.", "danger")
+        elif remaining <= 0:
+            pass  # typed text already fills the prompt
+        elif fname.endswith(".pdf"):
+            import fitz
+            with fitz.open(stream=uploaded_file.read(), filetype="pdf") as doc:
+                for page in doc:
+                    text = page.get_text("text", sort=False)
+                    parts.append(text)
+                    total += len(text) + 1
+                    if total >= remaining:
+                        break
+            extracted_text = "\n".join(parts)[:remaining]
+        elif fname.endswith(".docx"):
+            # Stream word/document.xml paragraph by paragraph instead of
+            # building python-docx's object tree
+            with zipfile.ZipFile(uploaded_file) as z, z.open("word/document.xml") as f:
+                for _, para in etree.iterparse(f, events=("end",), tag=_DOCX_P):
+                    text = _docx_paragraph_text(para)
+                    parts.append(text)
+                    total += len(text) + 1
+                    # Free parsed paragraphs as we go
+                    para.clear()
+                    while para.getprevious() is not None:
+                        del para.getparent()[0]
+                    if total >= remaining:
+                        break
+            extracted_text = "\n".join(parts)[:remaining]
+        else:
+            # At most 4 UTF-8 bytes per character, so this covers the budget
+            extracted_text = uploaded_file.read(remaining * 4).decode(errors="ignore")[:remaining]
+
+    # Combine all text (already within budget)
+    return title, (text_input + "\n" + extracted_text).strip()
+
+
 @app.route("/new", methods=["GET", "POST"])
 def create():
     if request.method == "POST":
-        title = request.form.get("title") or "Untitled"
-        text_input = request.form.get("text", "")
-
-        # -------- File upload extraction --------
-        uploaded_file = request.files.get("file")
-        extracted_text = ""
-        if uploaded_file and uploaded_file.filename:
-            fname = uploaded_file.filename.lower()
-            if fname.endswith(".pdf"):
-                import fitz
-                with fitz.open(stream=uploaded_file.read(), filetype="pdf") as doc:
-                    for page in doc:
-                        extracted_text += page.get_text()
-            elif fname.endswith(".docx"):
-                from docx import Document
-                doc = Document(uploaded_file)
-                for para in doc.paragraphs:
-                    extracted_text += para.text + "\n"
-            elif fname.endswith(".txt"):
-                extracted_text = uploaded_file.read().decode(errors="ignore")
-            else:
-                flash("Unsupported file type. Upload PDF, DOCX, or TXT.", "danger")
-
-        # Combine all text
-        full_text = (text_input + "\n" + extracted_text).strip()
-        if not full_text:
+        title, input_text = read_form_input()
+        if not input_text:
             flash("Please enter text or upload a document.", "danger")
             return redirect(url_for("create"))
 
-        # -------- Gemini generation --------
-        prompt = FLASHCARD_PROMPT.format(input_text=full_text[:8000])
+        # -------- Gemini generation (skipped on cache hit) --------
+        cards, embedding = cache_lookup(input_text)
+        if cards is None:
+            try:
+                data = validate_flashcards(generate_flashcards(input_text))
+                cards = data["flashcards"]
+                if not cards:
+                    raise ValueError("Empty flashcard list from Gemini")
+                cache_store(input_text, cards, embedding)
+            except Exception as e:
+                flash(f"LLM error or invalid JSON: {e}", "danger")
+                cards = [{"question": f"Sample Q{i+1}", "answer": "Sample A"} for i in range(5)]
 
-        try:
-            model_out = gemini_generate(prompt)
-            data = json.loads(model_out)
-            cards = data.get("flashcards", [])
-            if not cards:
-                raise ValueError("Empty flashcard list from Gemini")
-        except Exception as e:
-            flash(f"LLM error or invalid JSON: {e}", "danger")
-            cards = [{"question": f"Sample Q{i+1}", "answer": "Sample A"} for i in range(5)]
-
-        sid = str(len(STORE) + 1)
-        STORE[sid] = {"title": title, "cards": cards}
+        sid = secrets.token_urlsafe(8)
+        STORE.set(sid, {"title": sys.intern(title), "cards": to_cards(cards)})
         return redirect(url_for("view_set", set_id=sid))
 
     return render_template("create.html")
 
 
+def sse_event(event: str, payload) -> bytes:
+    return b"event: " + event.encode() + b"\ndata: " + orjson.dumps(payload) + b"\n\n"
+
+
+@app.route("/new/stream", methods=["POST"])
+def create_stream():
+    """
+    Same as POST /new, but streams each card to the page (text/event-stream)
+    as Gemini produces it, then sends a "done" event with the set URL.
+    """
+    title, input_text = read_form_input()
+    if not input_text:
+        return "Please enter text or upload a document.", 400
+
+    sid = secrets.token_urlsafe(8)
+    set_url = url_for("view_set", set_id=sid)
+
+    def events():
+        cards, embedding = cache_lookup(input_text)
+        if cards is not None:
+            for card in cards:
+                yield sse_event("card", card)
+        else:
+            cards = []
+            try:
+                for card in stream_flashcards(FLASHCARD_PROMPT.format(input_text=input_text)):
+                    cards.append(validate_card(card))
+                    yield sse_event("card", card)
+                if not cards:
+                    raise ValueError("Empty flashcard list from Gemini")
+                cache_store(input_text, cards, embedding)
+            except Exception as e:
+                print(f"[Gemini stream error] {e}")
+                yield sse_event("error", {"message": f"LLM error or invalid JSON: {e}"})
+                return
+
+        STORE.set(sid, {"title": sys.intern(title), "cards": to_cards(cards)})
+        yield sse_event("done", {"url": set_url})
+
+    return Response(
+        stream_with_context(events()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @app.route("/set/<set_id>")
 def view_set(set_id):
     s = STORE.get(set_id)
@@ -192,84 +814,179 @@ def view_set(set_id):
 # ------------------------------------------------------------
 # Export helpers
 # ------------------------------------------------------------
-def export_flashcards_pdf(cards, title):
-    from textwrap import wrap
+# Each gunicorn worker has its own pool, so split the cores between them.
+# gunicorn reads WEB_CONCURRENCY as its default worker count.
+PDF_WORKERS = int(os.getenv(
+    "PDF_WORKERS",
+    max(1, (os.cpu_count() or 1) // int(os.getenv("WEB_CONCURRENCY", 1))),
+))
+PDF_PARALLEL_MIN_CARDS = 100  # below this, process start-up outweighs the gain
+_PDF_POOL = None
 
+
+def _build_pptx_template_bytes() -> bytes:
+    """Blank default presentation, saved once so exports skip the template lookup."""
     bio = io.BytesIO()
-    c = pdf_canvas.Canvas(bio, pagesize=landscape(A4))
+    Presentation().save(bio)
+    return bio.getvalue()
+
+
+_PPTX_TEMPLATE_BYTES = _build_pptx_template_bytes()
+
+_WRAP_Q = TextWrapper(width=100)
+_WRAP_A = TextWrapper(width=110)
+
+
+# PPTX geometry and styles, built once rather than per slide/bullet
+_PPTX_LEFT, _PPTX_WIDTH = Inches(0.5), Inches(12)
+_PPTX_BODY_TOP, _PPTX_FOOTER_TOP, _PPTX_FOOTER_HEIGHT = Inches(1), Inches(6.5), Inches(0.5)
+_PPTX_Q_HEIGHT, _PPTX_A_HEIGHT = Inches(3), Inches(4)
+_PPTX_Q_SIZE, _PPTX_A_SIZE = Pt(32), Pt(22)
+_PPTX_BLACK = RGBColor(0, 0, 0)
+
+
+def card_labels(title: str, start: int, count: int):
+    """Header/footer labels ("<title> — Card <i>") for cards start..start+count-1."""
+    return [f"{title} — Card {i}" for i in range(start, start + count)]
+
+
+def answer_lines(answer: str):
+    """Splits an answer into lines; accepts real newlines or literal "\\n" escapes."""
+    return answer.replace("\\n", "\n").split("\n")
+
+
+def _render_pdf_shard(cards, title, start=1):
+    """Renders cards (numbered from start) to a standalone PDF, returns bytes."""
+    c = pdf_canvas.Canvas(None, pagesize=landscape(A4))
     w, h = landscape(A4)
 
-    for i, fc in enumerate(cards, start=1):
+    # showPage() resets the font, so each page still needs its own setFont
+    for label, fc in zip(card_labels(title, start, len(cards)), cards):
         # -------- Question Page --------
         c.setFont("Helvetica-Bold", 24)
-        c.drawCentredString(w / 2, h - 100, f"{title} — Card {i}")
+        c.drawCentredString(w / 2, h - 100, label)
         c.setFont("Helvetica", 18)
         text_obj = c.beginText(50, h - 180)
-        wrapped_q = wrap(fc["question"], width=100)
-        for line in wrapped_q:
-            text_obj.textLine(line)
+        text_obj.textLines(_WRAP_Q.wrap(fc.question))
         c.drawText(text_obj)
         c.showPage()
 
         # -------- Answer Page --------
         c.setFont("Helvetica-Bold", 20)
-        c.drawCentredString(w / 2, h - 100, f"{title} — Card {i} (Answer)")
+        c.drawCentredString(w / 2, h - 100, label + " (Answer)")
         c.setFont("Helvetica", 14)
         text_obj = c.beginText(70, h - 160)
-        lines = fc["answer"].split("\\n")
-        for line in lines:
-            for wrapped in wrap(line, width=110):
-                text_obj.textLine(wrapped)
+        text_obj.textLines([seg for ln in answer_lines(fc.answer) for seg in (_WRAP_A.wrap(ln) or [""])])
         c.drawText(text_obj)
         c.showPage()
 
-    c.save()
-    bio.seek(0)
-    return bio
+    return c.getpdfdata()
 
 
+def _get_pdf_pool():
+    global _PDF_POOL
+    if _PDF_POOL is None:
+        _PDF_POOL = ProcessPoolExecutor(max_workers=PDF_WORKERS)
+    return _PDF_POOL
 
-def export_flashcards_pptx(cards, title):
-    from pptx.enum.text import PP_ALIGN
-    from pptx.dml.color import RGBColor
 
-    prs = Presentation()
+def export_flashcards_pdf(cards, title):
+    """
+    Renders the set to PDF and returns the document bytes.
+    Large sets are split into shards rendered in parallel worker processes
+    and concatenated with pypdf.
+    """
+    if len(cards) < PDF_PARALLEL_MIN_CARDS or PDF_WORKERS < 2:
+        return _render_pdf_shard(cards, title)
+
+    shard_size = -(-len(cards) // PDF_WORKERS)
+    starts = range(0, len(cards), shard_size)
+    parts = _get_pdf_pool().map(
+        _render_pdf_shard,
+        [cards[s:s + shard_size] for s in starts],
+        repeat(title),
+        [s + 1 for s in starts],
+    )
+
+    writer = PdfWriter()
+    for part in parts:
+        writer.append(io.BytesIO(part))
+    out = io.BytesIO()
+    writer.write(out)
+    return out.getvalue()
+
+
+def _build_pptx_prototypes():
+    """
+    Builds one question slide and one answer slide with the full styling and
+    returns (question spTree, answer spTree, answer bullet <a:p>). Exports
+    deep-copy these and only set the text, instead of creating and styling
+    every text box per card.
+    """
+    prs = Presentation(io.BytesIO(_PPTX_TEMPLATE_BYTES))
+    layout = prs.slide_layouts[5]
+
+    # -------- Question Slide --------
+    slide_q = prs.slides.add_slide(layout)
+    tx_q = slide_q.shapes.add_textbox(_PPTX_LEFT, _PPTX_BODY_TOP, _PPTX_WIDTH, _PPTX_Q_HEIGHT)
+    tf_q = tx_q.text_frame
+    tf_q.word_wrap = True
+    p_q = tf_q.paragraphs[0]
+    p_q.text = "question"
+    p_q.font.size = _PPTX_Q_SIZE
+    p_q.font.bold = True
+    p_q.alignment = PP_ALIGN.CENTER
+    slide_q.shapes.add_textbox(_PPTX_LEFT, _PPTX_FOOTER_TOP, _PPTX_WIDTH, _PPTX_FOOTER_HEIGHT).text = "footer"
 
-    for i, fc in enumerate(cards, start=1):
+    # -------- Answer Slide --------
+    slide_a = prs.slides.add_slide(layout)
+    tx_a = slide_a.shapes.add_textbox(_PPTX_LEFT, _PPTX_BODY_TOP, _PPTX_WIDTH, _PPTX_A_HEIGHT)
+    tx_a.text_frame.word_wrap = True
+    p = tx_a.text_frame.add_paragraph()
+    p.text = "bullet"
+    p.level = 0
+    p.font.size = _PPTX_A_SIZE
+    p.font.color.rgb = _PPTX_BLACK
+    slide_a.shapes.add_textbox(_PPTX_LEFT, _PPTX_FOOTER_TOP, _PPTX_WIDTH, _PPTX_FOOTER_HEIGHT).text = "footer"
+
+    # Keep the bullet paragraph separately; the answer prototype keeps only
+    # the leading empty paragraph that add_paragraph() leaves behind
+    bullet = p._p
+    bullet.getparent().remove(bullet)
+
+    return slide_q.element.cSld.spTree, slide_a.element.cSld.spTree, bullet
+
+
+_PPTX_Q_SPTREE, _PPTX_A_SPTREE, _PPTX_A_BULLET = _build_pptx_prototypes()
+
+
+def _add_prototype_slide(prs, layout, sp_tree):
+    """Adds a slide whose shapes are a deep copy of sp_tree; returns them as a list."""
+    slide = prs.slides.add_slide(layout)
+    # Swap children in place: slide.shapes is cached against this spTree
+    slide.element.cSld.spTree[:] = list(copy.deepcopy(sp_tree))
+    return list(slide.shapes)
+
+
+def export_flashcards_pptx(cards, title):
+    prs = Presentation(io.BytesIO(_PPTX_TEMPLATE_BYTES))
+    layout = prs.slide_layouts[5]
+
+    for label, fc in zip(card_labels(title, 1, len(cards)), cards):
         # -------- Question Slide --------
-        slide_q = prs.slides.add_slide(prs.slide_layouts[5])
-
-        # Add question text box
-        tx_q = slide_q.shapes.add_textbox(Inches(0.5), Inches(1), Inches(12), Inches(3))
-        tf_q = tx_q.text_frame
-        tf_q.word_wrap = True
-        p_q = tf_q.paragraphs[0]
-        p_q.text = fc["question"]
-        p_q.font.size = Pt(32)
-        p_q.font.bold = True
-        p_q.alignment = PP_ALIGN.CENTER
-
-        # Add footer
-        footer_q = slide_q.shapes.add_textbox(Inches(0.5), Inches(6.5), Inches(12), Inches(0.5))
-        footer_q.text = f"{title} — Card {i} (Question)"
+        shapes = _add_prototype_slide(prs, layout, _PPTX_Q_SPTREE)
+        shapes[-2].text_frame.paragraphs[0].text = fc.question
+        shapes[-1].text_frame.paragraphs[0].text = label + " (Question)"
 
         # -------- Answer Slide --------
-        slide_a = prs.slides.add_slide(prs.slide_layouts[5])
-        tx_a = slide_a.shapes.add_textbox(Inches(0.5), Inches(1), Inches(12), Inches(4))
-        tf_a = tx_a.text_frame
-        tf_a.word_wrap = True
-
-        # Add each bullet line
-        for ln in fc["answer"].split("\\n"):
-            p = tf_a.add_paragraph()
+        shapes = _add_prototype_slide(prs, layout, _PPTX_A_SPTREE)
+        lines = answer_lines(fc.answer)
+        tx_body = shapes[-2].element.find(qn("p:txBody"))
+        for _ in lines:
+            tx_body.append(copy.deepcopy(_PPTX_A_BULLET))
+        for p, ln in zip(shapes[-2].text_frame.paragraphs[1:], lines):
             p.text = ln.strip()
-            p.level = 0
-            p.font.size = Pt(22)
-            p.font.color.rgb = RGBColor(0, 0, 0)
-
-        # Add footer
-        footer_a = slide_a.shapes.add_textbox(Inches(0.5), Inches(6.5), Inches(12), Inches(0.5))
-        footer_a.text = f"{title} — Card {i} (Answer)"
+        shapes[-1].text_frame.paragraphs[0].text = label + " (Answer)"
 
     bio = io.BytesIO()
     prs.save(bio)
@@ -284,9 +1001,9 @@ def export_pdf(set_id):
     s = STORE.get(set_id)
     if not s:
         return "Not found", 404
-    bio = export_flashcards_pdf(s["cards"], s["title"])
+    pdf_bytes = export_flashcards_pdf(s["cards"], s["title"])
     return send_file(
-        bio,
+        io.BytesIO(pdf_bytes),
         mimetype="application/pdf",
         as_attachment=True,
         download_name=f"{s['title']}.pdf",
@@ -308,5 +1025,6 @@ def export_pptx(set_id):
 
 
 # ------------------------------------------------------------
+# Local development only; production runs under gunicorn + gevent (see wsgi.py)
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=5000, debug=True)
+    app.run(host="0.0.0.0", port=5000, debug=os.getenv("FLASK_DEBUG") == "1")
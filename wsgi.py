@@ -0,0 +1,18 @@
+# wsgi.py
+# ------------------------------------------------------------
+# Production entrypoint:
+#   WEB_CONCURRENCY=1 gunicorn -k gevent --worker-connections 200 wsgi:app
+#
+# Flashcard sets are kept in process memory unless REDIS_URL is set, so
+# only raise WEB_CONCURRENCY once REDIS_URL points at a shared Redis
+# (app.py refuses to start otherwise).
+#
+# gevent must patch the stdlib (socket, ssl, threading) before Flask and
+# requests are imported, so the blocking Gemini HTTP wait yields to other
+# greenlets instead of holding the whole worker.
+# ------------------------------------------------------------
+from gevent import monkey
+
+monkey.patch_all()
+
+from app import app  # noqa: E402